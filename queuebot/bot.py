@@ -1,5 +1,5 @@
 from __future__ import annotations
-import json, os, re, requests, asyncio, pytz, importlib, traceback, logging
+import json, os, re, requests, asyncio, pytz, importlib, traceback, logging, socket
 from aiohttp.web import Request, Response, json_response
 from datetime import datetime, timedelta
 from launchpadlib.launchpad import Launchpad
@@ -20,8 +20,12 @@ from pathlib import Path
 from time import time
 from typing import Type, Tuple
 from urllib.parse import urlparse, unquote
-from .plugs import queue, tracker, packageset
+from .plugs import queue, tracker, packageset, lpcache
+from .plugs.index import paginate, parse_query, packageset_sources
+from .plugs.notice import state_digest
 from .floodprotection import FloodProtection
+from .coordination import Coordinator
+from .rules import RoomRules, PLUGINS
 
 qbot_change_level = EventType.find("com.ubuntu.qbot", t_class=EventType.Class.STATE)
 
@@ -29,6 +33,10 @@ class Config(BaseProxyConfig):
   def do_update(self, helper: ConfigUpdateHelper) -> None:
     helper.copy("whitelist")
     helper.copy("rooms")
+    helper.copy("coordination.database")
+    helper.copy("coordination.node")
+    helper.copy("coordination.lease")
+    helper.copy("coordination.retention")
 
 class Queuebot(Plugin):
   reminder_loop_task: asyncio.Future
@@ -39,6 +47,7 @@ class Queuebot(Plugin):
   plugin_tracker = tracker.Tracker("Builds", VERBOSE)
   room_ids = []
   room_mapping = {}
+  room_rules = {}
   power_level_cache: dict[RoomID, tuple[int, PowerLevelStateEventContent]]
 
   async def start(self) -> None:
@@ -48,6 +57,19 @@ class Queuebot(Plugin):
     logger = logging.getLogger(self.id)
     logger.setLevel(logging.DEBUG)
     self.log = logger
+    self.coordinator = None
+    self.delivery_task = None
+    self.unpublished = {}
+    if self.config["coordination.database"]:
+        node = self.config["coordination.node"] or f"{socket.gethostname()}/{self.id}"
+        self.coordinator = Coordinator(self.config["coordination.database"], node,
+                                       self.config["coordination.lease"], self.config["coordination.retention"], self.log)
+        await self.coordinator.start()
+        await self.check_lease()
+        self.lease_task = asyncio.create_task(self.renew_lease())
+    else:
+        for plugin in self.get_plugins():
+            plugin.start()
     if await self.resolve_room_aliases():
         self.poll_task = asyncio.create_task(self.poll_plugins())
         self.log.info("Queuebot started")
@@ -55,6 +77,113 @@ class Queuebot(Plugin):
   async def stop(self) -> None:
     await super().stop()
     self.poll_task.cancel()
+    if self.coordinator is not None:
+        self.lease_task.cancel()
+        if self.delivery_task is not None:
+            self.delivery_task.cancel()
+        await self.coordinator.stop()
+
+  def handles_commands(self) -> bool:
+    # Only the leader answers, standby nodes have no index to answer from
+    return self.coordinator is None or self.coordinator.is_leader
+
+  def get_plugins(self) -> list:
+    return [self.plugin_queue_new, self.plugin_queue_unapproved, self.plugin_tracker, self.plugin_packageset]
+
+  async def check_lease(self) -> None:
+    was_leader = self.coordinator.is_leader
+    if await self.coordinator.acquire() and not was_leader:
+        await self.take_over()
+
+  async def renew_lease(self) -> None:
+    while True:
+        try:
+            await self.check_lease()
+        except asyncio.CancelledError:
+            self.log.info("Lease renewal stopped")
+            return
+        except Exception:
+            self.log.exception("Error while renewing the scanner lease")
+        await asyncio.sleep(max(1, self.coordinator.lease // 3))
+
+  async def take_over(self) -> None:
+    # Continue from the baseline of the previous leader, so changes made
+    # while it was down are still announced, and finish its deliveries
+    for plugin in self.get_plugins():
+        name = f"{plugin.name}.{plugin.queue}"
+        entries = await self.coordinator.load_state(name)
+        batch = self.unpublished.get(name)
+        # A batch this node failed to publish before losing the lease is
+        # still good if nobody has moved the baseline on since
+        if batch is not None and batch[0] == state_digest(entries or ()):
+            continue
+        self.unpublished.pop(name, None)
+        if entries is not None:
+            plugin.load_state(entries)
+            self.log.debug(f"Loaded {len(entries)} entries of {name} state")
+    self.schedule_delivery()
+
+  def schedule_delivery(self) -> None:
+    # A single delivery loop at a time, or the flood throttle means nothing
+    if self.delivery_task is None or self.delivery_task.done():
+        self.delivery_task = background_task.create(self.deliver_pending())
+
+  async def publish(self, plugin) -> None:
+    name = f"{plugin.name}.{plugin.queue}"
+    # A scan that failed to publish goes first, update() would diff
+    # against its state and its notices would be lost
+    batch = self.unpublished.pop(name, None)
+    if batch is None:
+        notices = plugin.update()
+        self.log.debug(f"update() function called on {name}")
+        if notices is False:
+            return
+        # Taken right away, the scanner spawned by update() replaces it
+        batch = (plugin.generation, notices, plugin.get_state())
+    generation, notices, state = batch
+    try:
+        outbox = []
+        if notices and await self.resolve_room_aliases():
+            for notice in notices:
+                outbox.append((notice[0], [room_id for room_id in self.room_ids
+                                           if self.check_plugin_filter_mute(notice=notice, room_alias=self.room_mapping[room_id])]))
+        added = await self.coordinator.publish(name, generation, outbox, state)
+    except Exception:
+        self.unpublished[name] = batch
+        self.log.exception(f"Error publishing {name} notices, retrying next poll")
+        return
+    if added < len(outbox):
+        self.log.debug(f"{len(outbox) - added} notices from {name} were already in the outbox")
+
+  async def deliver_pending(self) -> None:
+    try:
+        sent_count = 0
+        for notice_hash, room_id, body in await self.coordinator.pending():
+            if not self.coordinator.is_leader:
+                self.log.debug("Lost the lease, leaving deliveries to the new leader")
+                return
+            if sent_count >= 5:
+                self.log.debug(f"sent count reached: {sent_count} sleeping 60 secs")
+                await asyncio.sleep(60)
+                sent_count = 0
+            attempt = await self.coordinator.claim(notice_hash, room_id)
+            if attempt is None:
+                continue
+            try:
+                # Homeservers only dedup transaction ids within a session, so
+                # this covers retries from this node but not a takeover
+                txn_id = "qbot-" + Coordinator.notice_hash(notice_hash, room_id)[:32]
+                await self.client.send_notice(room_id, body, txn_id=txn_id)
+                await self.coordinator.mark_sent(notice_hash, room_id)
+                sent_count += 1
+            except Exception as e:
+                self.log.debug(f"Error sending notice to {room_id}: {e}")
+                self.log.debug(traceback.format_exc())
+                if attempt >= self.coordinator.max_attempts:
+                    self.log.warning(f"Giving up on a notice to {room_id} after {attempt} attempts")
+    except Exception as e:
+        self.log.debug(f"Error delivering notices: {e}")
+        self.log.debug(traceback.format_exc())
 
   async def get_power_levels(self, room_id: RoomID) -> PowerLevelStateEventContent:
         try:
@@ -82,28 +211,110 @@ class Queuebot(Plugin):
 
   @command.new(name="qbot", require_subcommand=False)
   async def qbot(self, evt: MessageEvent) -> None:
+        if not self.handles_commands():
+            return False
         if not await self.can_manage(evt) and self.flood_protection.flood_check(evt.sender):
             await evt.respond("You don't have the permission to use this command.")
             return False
         await evt.respond("Invalid argument. Example: !qbot mute queue")
         return False
   @qbot.subcommand("mute", aliases=["unmute"])
-  @command.argument("plugin", "(un)mute a plugin", required=False)
+  @command.argument("plugin", "(un)mute a plugin or a key such as queue;noble-proposed", required=False)
   async def mute(self, evt: MessageEvent, plugin: str) -> None:
+    if not self.handles_commands():
+        return False
     if not await self.can_manage(evt) and self.flood_protection.flood_check(evt.sender):
         await evt.respond("You don't have the permission to manage mutes.")
         return False
-    if not plugin or plugin not in ["queue", "tracker", "packageset"]:
-        await evt.respond("Invalid plugin. Valid plugins are queue, tracker and packageset. Example: !qbot mute queue")
+    plugin = (plugin or "").lower()
+    if re.split(r"[.;]", plugin)[0] not in PLUGINS:
+        await evt.respond("Invalid plugin. Valid plugins are queue, tracker and packageset. Example: !qbot mute queue or !qbot mute queue;noble-proposed")
         return False
     room_alias = self.room_mapping[evt.room_id]
-    if plugin in self.config["rooms"][room_alias]['mute']:
-        self.config["rooms"][room_alias]['mute'].remove(plugin)
+    mutes = list(self.config["rooms"][room_alias]['mute'])
+    if self.coordinator is not None:
+        # Mutes set through the command are shared by all instances
+        mutes = (await self.coordinator.load_mutes()).get(room_alias, mutes)
+    if plugin in mutes:
+        mutes.remove(plugin)
         await evt.respond(f"Unmuted {plugin}")
     else:
-        self.config["rooms"][room_alias]['mute'].append(plugin)
+        mutes.append(plugin)
         await evt.respond(f"Muted {plugin}")
+    if self.coordinator is not None:
+        await self.coordinator.save_mutes(room_alias, mutes)
+    self.config["rooms"][room_alias]['mute'] = mutes
     self.config.save()
+    self.room_rules[room_alias] = RoomRules(self.config["rooms"][room_alias], mutes)
+
+  @qbot.subcommand("queue", help="Show the current content of a queue")
+  @command.argument("queue_name", "queue name", required=False)
+  @command.argument("query", "series, pocket, source, arch, packageset or page", required=False, pass_raw=True)
+  async def queue_lookup(self, evt: MessageEvent, queue_name: str, query: str) -> None:
+    if not self.handles_commands():
+        return False
+    if not await self.can_manage(evt) and not self.flood_protection.flood_check(evt.sender):
+        return False
+    plugins = {plugin.queue.lower(): plugin for plugin in [self.plugin_queue_new, self.plugin_queue_unapproved]}
+    if not queue_name or queue_name.lower() not in plugins:
+        await evt.respond("Invalid queue. Valid queues are New and Unapproved. Example: !qbot queue Unapproved noble-proposed")
+        return False
+    plugin = plugins[queue_name.lower()]
+    index = plugin.index()
+    if index is None:
+        await evt.respond(f"The {plugin.queue} queue has not been scanned yet.")
+        return False
+    terms = (query or "").lower().split()
+    pkgsets = []
+    pkgset_index = self.plugin_packageset.index()
+    if pkgset_index is not None:
+        pkgsets = [term for term in terms if not index.has("source", term) and pkgset_index.has("packageset", term)]
+        terms = [term for term in terms if term not in pkgsets]
+    criteria, page, unknown = parse_query(index, terms)
+    if unknown:
+        await evt.respond(f"Nothing in {plugin.queue} matches: {', '.join(unknown)}")
+        return False
+    # Packageset names narrow the query to the sources they contain
+    if pkgsets:
+        sources = packageset_sources(pkgset_index, pkgsets, criteria)
+        criteria["source"] = criteria.get("source", sources) & sources
+    entries, page, pages = paginate(index.lookup(**criteria), page)
+    if not entries:
+        await evt.respond(f"Nothing in {plugin.queue} matches this query.")
+        return False
+    lines = [f"{plugin.queue}: page {page}/{pages}"]
+    for entry in entries:
+        lines.append("%s [%s] (%s/%s) [%s]" % (entry["source"], entry["arch"], entry["pocket"], entry["archive"], entry["version"]))
+    await evt.respond("\n".join(lines), markdown=False)
+
+  @qbot.subcommand("packageset", help="Show which packagesets contain a source")
+  @command.argument("query", "source, series, packageset or page", required=False, pass_raw=True)
+  async def packageset_lookup(self, evt: MessageEvent, query: str) -> None:
+    if not self.handles_commands():
+        return False
+    if not await self.can_manage(evt) and not self.flood_protection.flood_check(evt.sender):
+        return False
+    terms = (query or "").lower().split()
+    if not terms:
+        await evt.respond("Missing query. Example: !qbot packageset foo noble")
+        return False
+    index = self.plugin_packageset.index()
+    if index is None:
+        await evt.respond("The packagesets have not been scanned yet.")
+        return False
+    # A source sharing its name with a packageset is what people ask about
+    criteria, page, unknown = parse_query(index, terms, ("series", "source", "packageset"))
+    if unknown:
+        await evt.respond(f"No packageset matches: {', '.join(unknown)}")
+        return False
+    entries, page, pages = paginate(index.lookup(**criteria), page)
+    if not entries:
+        await evt.respond("No packageset matches this query.")
+        return False
+    lines = [f"Packagesets: page {page}/{pages}"]
+    for entry in entries:
+        lines.append("%s: %s in %s" % (entry["packageset"], entry["source"], entry["series"]))
+    await evt.respond("\n".join(lines), markdown=False)
 
   async def resolve_room_alias_to_id(self, room_alias: str):
         try:
@@ -117,6 +328,8 @@ class Queuebot(Plugin):
   async def resolve_room_aliases(self):
     self.room_ids = []
     self.room_mapping = {}
+    self.room_rules = {}
+    shared_mutes = await self.coordinator.load_mutes() if self.coordinator is not None else {}
     for room_alias in self.config["rooms"]:
         if room_alias.startswith("#"):
             if room_id_obj := await self.resolve_room_alias_to_id(room_alias):
@@ -130,6 +343,8 @@ class Queuebot(Plugin):
             self.log.info("Added room id " + room_alias)
         else:
             self.log.debug("Error addming room " + room_alias)
+            continue
+        self.room_rules[room_alias] = RoomRules(self.config["rooms"][room_alias], shared_mutes.get(room_alias))
     return True
     
   def check_access_sender(self, sender):
@@ -137,45 +352,25 @@ class Queuebot(Plugin):
          return True
       return False
 
-  def check_plugin_filter_mute(self, plugin_name, queue, notice, room_id, room_alias):
+  def check_plugin_filter_mute(self, notice, room_alias):
     try:
+        rules = self.room_rules[room_alias]
         # is the plugin enabled
-        if self.config['rooms'][room_alias].get(plugin_name) is None:
-            self.log.debug(f"plugin_name {plugin_name} is None for {room_alias}")
-            return False
-        queues = self.config['rooms'][room_alias].get(plugin_name)
-        if isinstance(queues, list):
-            if queue not in queues:
-                self.log.debug(f"queue {plugin_name}.{queue} not queues for {room_alias}")
-                return False
-        elif isinstance(queues, str):
-            if queue != queues:
-                self.log.debug(f"queue {plugin_name}.{queue} not in queue string for {room_alias}")
-                return False
-        else:
-            self.log.debug(f"queues is not str or list for {room_alias}")
+        if not rules.enabled(notice):
+            self.log.debug(f"queue {notice.plugin}.{notice.queue} not enabled for {room_alias}")
             return False
-        
-        if self.config['rooms'][room_alias].get('mute') is None:
-            return True
-        mutes = self.config['rooms'][room_alias].get('mute')
-        mute_name = f"{plugin_name}.{queue}".lower()
-        if not isinstance(mutes, list) or len(mutes) < 1:
-            self.log.debug(f"mutes in {room_alias} is not a valid list or empty")
-        elif mute_name in mutes:
-            self.log.debug(f"{mute_name} is in mutes for {room_alias}")
+        if rules.muted(notice):
+            self.log.debug(f"{notice.plugin}.{notice.queue} notice is muted for {room_alias}")
             return False
         # is there a filter
-        filter_name = plugin_name + '_filter'.lower()
-        if self.config['rooms'][room_alias].get(filter_name) is not None:
-            if str(self.config['rooms'][room_alias][filter_name]).lower() not in notice.lower():
-                self.log.debug(f"not sending notice to {room_alias} as it matches filter " + str(self.config['rooms'][room_alias][filter_name]).lower() )
-                return False
+        if rules.filtered(notice):
+            self.log.debug(f"not sending notice to {room_alias} as it does not match filter {rules.filters[notice.plugin]}")
+            return False
     except Exception as e:
         self.log.debug("Error checking filter or mute: " + str(e))
         self.log.debug(traceback.format_exc())
         return False
-    
+
     return True
 
   async def poll_plugins(self) -> None:
@@ -198,10 +393,16 @@ class Queuebot(Plugin):
             await asyncio.sleep(self.config["update_interval"] * 60)
   async def _poll_once(self) -> None:
     try:
-        plugins_to_poll = [self.plugin_queue_new, self.plugin_queue_unapproved, self.plugin_tracker, self.plugin_packageset]
+        if self.coordinator is not None and not self.coordinator.is_leader:
+            self.log.debug("Standing by, another node holds the scanner lease")
+            return
+        plugins_to_poll = self.get_plugins()
         for plugin_name in plugins_to_poll:
             if not hasattr(plugin_name, 'update'):
                 continue
+            if self.coordinator is not None:
+                await self.publish(plugin_name)
+                continue
             notices = plugin_name.update()
             self.log.debug('update() function called on ' + str(plugin_name.name) + '.' + str(plugin_name.queue))
             sent_count = 0
@@ -214,7 +415,7 @@ class Queuebot(Plugin):
                                 try:
                                     room_alias = self.room_mapping[room_id]
                                     self.log.debug(f"Checking notices or {room_alias}  ( {room_id} )")
-                                    if self.check_plugin_filter_mute(plugin_name=plugin_name.name,queue=plugin_name.queue, notice=notice[0], room_id=room_id, room_alias=room_alias):
+                                    if self.check_plugin_filter_mute(notice=notice, room_alias=room_alias):
                                         self.log.debug(f"new notice from {plugin_name.name}.{plugin_name.queue} to {room_alias}")
                                         self.log.debug(f"sent count: {sent_count}")
                                         if sent_count >= 5:
@@ -229,6 +430,10 @@ class Queuebot(Plugin):
                                     self.log.debug(f"Error sending notice to {room_id}: {e}")
                                     self.log.debug(traceback.format_exc())
                                     pass
+        if self.coordinator is not None:
+            self.schedule_delivery()
+            await self.coordinator.prune()
+        self.log.debug(f"Launchpad response cache: {lpcache.get_cache().stats()}")
     except Exception as e:
         self.log.debug(f"Error polling plugins: {e}")
         self.log.debug(traceback.format_exc())
@@ -0,0 +1,221 @@
+from __future__ import annotations
+import json, hashlib, logging
+from time import time
+from mautrix.util.async_db import Database, UpgradeTable, Connection, Scheme
+
+upgrade_table = UpgradeTable()
+
+@upgrade_table.register(description="Leader lease, notice outbox, delivery tracking and room mutes")
+async def upgrade_v1(conn: Connection, scheme: Scheme) -> None:
+    await conn.execute(
+        """CREATE TABLE leader_lease (
+            name    TEXT PRIMARY KEY,
+            node    TEXT NOT NULL,
+            expires BIGINT NOT NULL
+        )"""
+    )
+    await conn.execute(
+        """CREATE TABLE notice_outbox (
+            hash    TEXT PRIMARY KEY,
+            plugin  TEXT NOT NULL,
+            body    TEXT NOT NULL,
+            created BIGINT NOT NULL
+        )"""
+    )
+    await conn.execute(
+        """CREATE TABLE notice_delivery (
+            hash    TEXT NOT NULL REFERENCES notice_outbox(hash),
+            room_id TEXT NOT NULL,
+            node    TEXT,
+            claimed BIGINT NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            sent    BIGINT,
+            PRIMARY KEY (hash, room_id)
+        )"""
+    )
+    await conn.execute(
+        """CREATE TABLE scanner_state (
+            name    TEXT PRIMARY KEY,
+            entries TEXT NOT NULL,
+            updated BIGINT NOT NULL
+        )"""
+    )
+    await conn.execute(
+        """CREATE TABLE room_mute (
+            room  TEXT PRIMARY KEY,
+            mutes TEXT NOT NULL
+        )"""
+    )
+
+class Coordinator:
+    """Coordinates several queuebot instances through a shared SQL store.
+
+    Only the node holding the lease scans. Notices go through a shared
+    outbox keyed by a hash of the notice and the baseline it was diffed
+    against, so a diff replayed around a failover is stored once while a
+    later repeat of the same text is a new notice. Every (notice, room)
+    pair is claimed before sending and marked once sent, so a new leader
+    delivers what the previous one left pending. A delivery is given up
+    after max_attempts claims.
+    """
+    lease_name = "scanner"
+    max_attempts = 5
+
+    def __init__(self, url: str, node: str, lease: int = 60, retention: int = 3600, log: logging.Logger = None):
+        self.node = node
+        self.lease = lease
+        self.retention = retention
+        self.log = log or logging.getLogger("queuebot.coordination")
+        self.is_leader = False
+        self.db = Database.create(url, upgrade_table=upgrade_table, log=self.log, owner_name="queuebot")
+
+    async def start(self) -> None:
+        await self.db.start()
+
+    async def stop(self) -> None:
+        await self.release()
+        await self.db.stop()
+
+    async def acquire(self) -> bool:
+        """Take or renew the lease, returns whether this node is the leader."""
+        now = int(time())
+        try:
+            await self.db.execute(
+                """INSERT INTO leader_lease (name, node, expires) VALUES ($1, $2, $3)
+                ON CONFLICT (name) DO UPDATE SET node=excluded.node, expires=excluded.expires
+                WHERE leader_lease.node=excluded.node OR leader_lease.expires < $4""",
+                self.lease_name, self.node, now + self.lease, now,
+            )
+            leader = await self.db.fetchval("SELECT node FROM leader_lease WHERE name=$1", self.lease_name)
+        except Exception:
+            # Without the store we can't tell whether the lease still holds
+            self.is_leader = False
+            raise
+        if (leader == self.node) != self.is_leader:
+            self.log.info(f"Node {self.node} is now {'leader' if leader == self.node else 'standby'} (leader: {leader})")
+        self.is_leader = leader == self.node
+        return self.is_leader
+
+    async def release(self) -> None:
+        """Give up the lease so a standby node takes over right away."""
+        if not self.is_leader:
+            return
+        await self.db.execute(
+            "UPDATE leader_lease SET expires=0 WHERE name=$1 AND node=$2",
+            self.lease_name, self.node,
+        )
+        self.is_leader = False
+
+    @staticmethod
+    def notice_hash(*parts: str) -> str:
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    async def enqueue(self, plugin: str, generation: str, body: str, room_ids: list[str]) -> bool:
+        """Add a notice for the given rooms, returns False for a duplicate.
+
+        generation identifies the scanner baseline the notice was computed
+        against, see plugs.notice.state_digest().
+        """
+        async with self.db.acquire() as conn, conn.transaction():
+            return await self._enqueue(conn, plugin, generation, body, room_ids)
+
+    async def _enqueue(self, conn: Connection, plugin: str, generation: str, body: str, room_ids: list[str]) -> bool:
+        notice_hash = self.notice_hash(plugin, generation, body)
+        inserted = await conn.fetchval(
+            """INSERT INTO notice_outbox (hash, plugin, body, created) VALUES ($1, $2, $3, $4)
+            ON CONFLICT (hash) DO NOTHING RETURNING hash""",
+            notice_hash, plugin, body, int(time()),
+        )
+        if inserted is None:
+            return False
+        for room_id in room_ids:
+            await conn.execute(
+                "INSERT INTO notice_delivery (hash, room_id) VALUES ($1, $2)",
+                notice_hash, room_id,
+            )
+        return True
+
+    async def publish(self, plugin: str, generation: str, notices: list[tuple[str, list[str]]], state: set | None) -> int:
+        """Enqueue the (body, room_ids) notices of a scan and save its state.
+
+        Both happen in one transaction, so after a failure the stored
+        baseline is still the one the notices were computed against.
+        Returns the number of notices that were not duplicates.
+        """
+        added = 0
+        async with self.db.acquire() as conn, conn.transaction():
+            for body, room_ids in notices:
+                added += await self._enqueue(conn, plugin, generation, body, room_ids)
+            if state is not None:
+                await self._save_state(conn, plugin, state)
+        return added
+
+    async def pending(self) -> list[tuple[str, str, str]]:
+        """Return the (hash, room_id, body) deliveries nobody holds a live claim on."""
+        rows = await self.db.fetch(
+            """SELECT d.hash, d.room_id, o.body FROM notice_delivery d
+            JOIN notice_outbox o ON o.hash=d.hash
+            WHERE d.sent IS NULL AND d.claimed < $1 AND d.attempts < $2
+            ORDER BY o.created, d.hash, d.room_id""",
+            int(time()) - self.lease, self.max_attempts,
+        )
+        return [(row["hash"], row["room_id"], row["body"]) for row in rows]
+
+    async def claim(self, notice_hash: str, room_id: str) -> int | None:
+        """Claim a delivery, returns the attempt number or None if taken."""
+        now = int(time())
+        return await self.db.fetchval(
+            """UPDATE notice_delivery SET node=$1, claimed=$2, attempts=attempts+1
+            WHERE hash=$3 AND room_id=$4 AND sent IS NULL AND claimed < $5 AND attempts < $6
+            RETURNING attempts""",
+            self.node, now, notice_hash, room_id, now - self.lease, self.max_attempts,
+        )
+
+    async def mark_sent(self, notice_hash: str, room_id: str) -> None:
+        await self.db.execute(
+            "UPDATE notice_delivery SET sent=$1 WHERE hash=$2 AND room_id=$3",
+            int(time()), notice_hash, room_id,
+        )
+
+    async def prune(self) -> None:
+        """Forget settled notices older than the retention period.
+
+        A notice is settled once every room got it or was given up on.
+        """
+        expired = """SELECT hash FROM notice_outbox WHERE created < $1 AND NOT EXISTS (
+            SELECT 1 FROM notice_delivery d
+            WHERE d.hash=notice_outbox.hash AND d.sent IS NULL AND d.attempts < $2
+        )"""
+        cutoff = int(time()) - self.retention
+        async with self.db.acquire() as conn, conn.transaction():
+            await conn.execute(f"DELETE FROM notice_delivery WHERE hash IN ({expired})", cutoff, self.max_attempts)
+            await conn.execute(f"DELETE FROM notice_outbox WHERE hash IN ({expired})", cutoff, self.max_attempts)
+
+    async def save_state(self, name: str, entries: set) -> None:
+        await self._save_state(self.db, name, entries)
+
+    @staticmethod
+    async def _save_state(conn: Connection | Database, name: str, entries: set) -> None:
+        await conn.execute(
+            """INSERT INTO scanner_state (name, entries, updated) VALUES ($1, $2, $3)
+            ON CONFLICT (name) DO UPDATE SET entries=excluded.entries, updated=excluded.updated""",
+            name, json.dumps(sorted(entries)), int(time()),
+        )
+
+    async def load_state(self, name: str) -> set | None:
+        entries = await self.db.fetchval("SELECT entries FROM scanner_state WHERE name=$1", name)
+        if entries is None:
+            return None
+        return set(json.loads(entries))
+
+    async def load_mutes(self) -> dict[str, list[str]]:
+        """Return the mutes set through !qbot mute, by room."""
+        rows = await self.db.fetch("SELECT room, mutes FROM room_mute")
+        return {row["room"]: json.loads(row["mutes"]) for row in rows}
+
+    async def save_mutes(self, room: str, mutes: list[str]) -> None:
+        await self.db.execute(
+            """INSERT INTO room_mute (room, mutes) VALUES ($1, $2)
+            ON CONFLICT (room) DO UPDATE SET mutes=excluded.mutes""",
+            room, json.dumps(mutes),
+        )
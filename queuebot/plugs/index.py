@@ -0,0 +1,97 @@
+#!/usr/bin/python
+from __future__ import print_function
+
+from collections import defaultdict
+
+
+class StateIndex():
+    """Secondary indexes over the entries of a scanner state.
+
+    Every entry is a dict, and each of the indexed fields maps a value to
+    the set of entry positions carrying it, so lookups are plain set
+    intersections instead of a walk over the whole state. Entries are
+    sorted by the indexed fields once, so positions are in display order.
+    """
+
+    def __init__(self, fields, entries=()):
+        self.fields = fields
+        self.entries = sorted(entries, key=lambda entry: [
+            entry[field] for field in fields])
+        self.keys = dict((field, defaultdict(set)) for field in fields)
+        for position, entry in enumerate(self.entries):
+            for field in fields:
+                self.keys[field][entry[field]].add(position)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def has(self, field, value):
+        return value in self.keys[field]
+
+    def lookup(self, **criteria):
+        """Return the entries matching all criteria, sorted.
+
+        A criterion value may be a single value or a collection of
+        accepted values for that field.
+        """
+        matches = None
+        for field, wanted in criteria.items():
+            if isinstance(wanted, str):
+                wanted = (wanted,)
+            positions = set()
+            for value in wanted:
+                positions |= self.keys[field].get(value, set())
+            matches = positions if matches is None else matches & positions
+            if not matches:
+                return list()
+
+        if matches is None:
+            return list(self.entries)
+        return [self.entries[position] for position in sorted(matches)]
+
+
+def parse_query(index, terms, fields=None):
+    """Split query terms into index criteria and a page number.
+
+    Each term is matched against the fields in order, the index fields
+    unless given, so the first field holding the value wins. Returns
+    (criteria, page, unknown terms).
+    """
+    criteria = {}
+    page = 1
+    unknown = []
+    for term in terms:
+        if term.isdigit():
+            page = int(term)
+            continue
+        for field in fields or index.fields:
+            if index.has(field, term):
+                criteria.setdefault(field, set()).add(term)
+                break
+        else:
+            unknown.append(term)
+    return criteria, page, unknown
+
+
+def packageset_sources(pkgset_index, pkgsets, criteria):
+    """Return the sources of the packagesets in the series of a query.
+
+    The series come from queue criteria, given directly or through a
+    pocket; without any the packagesets of every series are used.
+    """
+    series = set(criteria.get("series", ()))
+    series.update(pocket.split('-')[0]
+                  for pocket in criteria.get("pocket", ()))
+    pkgset_criteria = {"packageset": pkgsets}
+    if series:
+        pkgset_criteria["series"] = series
+    return set(entry["source"]
+               for entry in pkgset_index.lookup(**pkgset_criteria))
+
+
+def paginate(items, page=1, per_page=10):
+    """Return (items on page, page, pages) with page clamped to range."""
+    pages = max(1, (len(items) + per_page - 1) // per_page)
+    page = min(max(1, page), pages)
+    start = (page - 1) * per_page
+    return items[start:start + per_page], page, pages
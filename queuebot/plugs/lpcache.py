@@ -0,0 +1,177 @@
+#!/usr/bin/python
+from __future__ import print_function
+
+import os
+import threading
+from launchpadlib.credentials import AnonymousAccessToken, Credentials
+from launchpadlib.launchpad import Launchpad, LaunchpadOAuthAwareHttp
+from launchpadlib.uris import lookup_service_root
+from lazr.restfulclient._browser import MultipleRepresentationCache
+
+CACHE_DIR = "/tmp/queuebot/cache/"
+CACHE_SIZE = 512 * 1024 * 1024
+
+
+class SharedCache(MultipleRepresentationCache):
+    """Size-bounded launchpadlib response cache shared by all scanners.
+
+    httplib2 stores the ETag and Last-Modified headers along with each
+    response and revalidates stale entries with If-None-Match and
+    If-Modified-Since, so an unchanged collection costs a 304 instead of
+    its full body. Writes are atomic renames and the media type of the
+    current request is kept per thread, which makes the cache safe to
+    share between scanner threads. Once the directory grows past max_size
+    the oldest entries are removed.
+
+    Requests made through track() are counted as fresh (served without
+    asking Launchpad), not_modified (revalidated with a 304) or
+    downloaded (full body transferred).
+    """
+
+    def __init__(self, cache_dir, max_size=CACHE_SIZE):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.local = threading.local()
+        MultipleRepresentationCache.__init__(self, cache_dir)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.fresh = 0
+        self.not_modified = 0
+        self.downloaded = 0
+        self.evictions = 0
+        self.sizes = dict((path, size)
+                          for path, size, mtime in self.entries())
+        self.size = sum(self.sizes.values())
+
+    # lazr.restfulclient sets this right before each request, it has to
+    # stay with the thread making that request
+    @property
+    def request_media_type(self):
+        return getattr(self.local, 'request_media_type', None)
+
+    @request_media_type.setter
+    def request_media_type(self, media_type):
+        self.local.request_media_type = media_type
+
+    def entries(self):
+        for name in os.listdir(self.cache_dir):
+            # Leave files that are still being written alone
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+    def track(self, request, uri, method="GET", *args, **kwargs):
+        """Make a request through request() and count what it cost."""
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            self.local.written = False
+            self.local.read = []
+        self.local.depth = depth + 1
+        try:
+            response, content = request(uri, method, *args, **kwargs)
+        finally:
+            self.local.depth = depth
+
+        # Redirects come back through here, count the outermost request
+        if depth == 0 and method == "GET" and response.status == 200:
+            with self.lock:
+                if not response.fromcache:
+                    self.downloaded += 1
+                elif self.local.written:
+                    # httplib2 rewrites the entry's headers after a 304
+                    self.not_modified += 1
+                else:
+                    self.fresh += 1
+                    self.touch(self.local.read)
+        return response, content
+
+    def touch(self, paths):
+        # Fresh hits are not written again, bump their mtime so evict()
+        # sees them as recently used
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        value = MultipleRepresentationCache.get(self, key)
+        if value is not None and getattr(self.local, 'depth', 0):
+            self.local.read.append(self._get_key_path(key))
+        return value
+
+    def set(self, key, value):
+        MultipleRepresentationCache.set(self, key, value)
+        path = self._get_key_path(key)
+        self.local.written = True
+        with self.lock:
+            self.size += len(value) - self.sizes.get(path, 0)
+            self.sizes[path] = len(value)
+            if self.size > self.max_size:
+                self.evict()
+
+    def delete(self, key):
+        MultipleRepresentationCache.delete(self, key)
+        with self.lock:
+            self.size -= self.sizes.pop(self._get_key_path(key), 0)
+
+    def evict(self):
+        # Entries are rewritten after a 304 and touched on a fresh hit, so
+        # the oldest files are the ones no scanner has asked for in a while
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.sizes = dict((path, size) for path, size, mtime in entries)
+        self.size = sum(self.sizes.values())
+        for path, size, mtime in entries:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= self.sizes.pop(path)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {"fresh": self.fresh, "not_modified": self.not_modified,
+                    "downloaded": self.downloaded,
+                    "evictions": self.evictions, "size": self.size}
+
+
+class CachedHttp(LaunchpadOAuthAwareHttp):
+    def request(self, uri, method="GET", *args, **kwargs):
+        return self.cache.track(super().request, uri, method,
+                                *args, **kwargs)
+
+
+class CachedLaunchpad(Launchpad):
+    def httpFactory(self, credentials, cache, timeout, proxy_info):
+        return CachedHttp(self, self.authorization_engine, credentials,
+                          cache, timeout, proxy_info)
+
+
+shared_cache = None
+shared_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global shared_cache
+    with shared_cache_lock:
+        if shared_cache is None:
+            shared_cache = SharedCache(CACHE_DIR)
+        return shared_cache
+
+
+def login():
+    """Anonymous Launchpad login going through the shared cache."""
+    credentials = Credentials('maubot-queuebot',
+                              access_token=AnonymousAccessToken())
+    return CachedLaunchpad(credentials, None, None,
+                           service_root=lookup_service_root('production'),
+                           cache=get_cache())
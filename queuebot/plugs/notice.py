@@ -0,0 +1,57 @@
+#!/usr/bin/python
+from __future__ import print_function
+
+import hashlib
+from typing import NamedTuple
+
+
+def state_digest(state):
+    """Identify a scanner baseline, notices diffed against it share it."""
+    return hashlib.sha256("\n".join(sorted(state)).encode("utf-8")).hexdigest()
+
+
+def mute_key(value):
+    # Mute keys are single words, e.g. "tracker;noble-daily"
+    return "-".join(value.lower().split())
+
+
+class Notice(NamedTuple):
+    """A notice along with the fields rooms mute and filter on.
+
+    It is still a tuple starting with (text, mute) and keys holds every
+    mute key matching the notice. Use Notice.create() so it is filled in.
+    """
+    text: str
+    mute: tuple
+    plugin: str
+    queue: str
+    series: str = ""
+    pocket: str = ""
+    arch: str = ""
+    packageset: tuple = ()
+    source: str = ""
+    milestone: str = ""
+    product: str = ""
+    keys: frozenset = frozenset()
+
+    @classmethod
+    def create(cls, text, mute, plugin, queue, series="", pocket="",
+               arch="", packageset=(), source="", milestone="",
+               product=""):
+        name = plugin.lower()
+        queue_name = queue.lower()
+        values = [mute_key(value) for value in
+                  (series, pocket, arch, source, milestone, product) +
+                  tuple(packageset) if value]
+
+        keys = set([name, "%s.%s" % (name, queue_name),
+                    "%s;%s" % (name, queue_name)])
+        keys.update(key.lower() for key in mute)
+        for value in values:
+            keys.add("%s;%s" % (name, value))
+            keys.add("%s;%s;%s" % (name, value, queue_name))
+            keys.add("%s;%s;%s" % (name, queue_name, value))
+
+        return cls(text, tuple(mute), plugin, queue, series, pocket, arch,
+                   tuple(packageset), source, milestone, product,
+                   frozenset(keys))
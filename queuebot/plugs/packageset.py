@@ -3,18 +3,32 @@ from __future__ import print_function
 
 import traceback
 import threading
-from launchpadlib.launchpad import Launchpad
+from . import lpcache
+from .index import StateIndex
+from .notice import Notice, state_digest
+
+
+def build_index(state):
+    """Index packageset entries by series, packageset and source name."""
+    entries = list()
+    for pkg in state:
+        pkg_seriesurl, pkg_series, pkg_set, pkg_name = pkg.split(';')
+        entries.append({
+            "series": pkg_series,
+            "packageset": pkg_set,
+            "source": pkg_name,
+        })
+    return StateIndex(("series", "packageset", "source"), entries)
 
 
 class PackagesetScanner(threading.Thread):
     notices = list()
+    generation = ""
 
     def run(self):
         try:
             # Authenticated login to Launchpad
-            self.lp = Launchpad.login_anonymously(
-                'maubot-queuebot', 'production',
-                launchpadlib_dir="/tmp/queuebot-%s/" % self.queue)
+            self.lp = lpcache.login()
 
             self.notices = list()
 
@@ -39,41 +53,50 @@ class PackagesetScanner(threading.Thread):
                             pkg
                         ]))
 
+            # The notices below are a diff against this baseline
+            self.generation = state_digest(
+                self.queue_state.get(self.queue, ()))
+
             if self.queue in self.queue_state:
                 if len(new_list - self.queue_state[self.queue]) > 25:
-                    self.notices.append(("%s: %s entries have been"
-                                         " added or removed" %
-                                         (self.queue,
-                                          len(new_list -
-                                              self.queue_state[self.queue])),
-                                         ['packageset']))
+                    self.notices.append(Notice.create(
+                        "%s: %s entries have been added or removed" % (
+                            self.queue,
+                            len(new_list - self.queue_state[self.queue])),
+                        ['packageset'], "packageset", self.queue))
                 elif len(self.queue_state[self.queue] - new_list) > 25:
-                    self.notices.append(("%s: %s entries have been"
-                                         " added or removed" %
-                                         (self.queue,
-                                          len(self.queue_state[self.queue] -
-                                              new_list)),
-                                         ['packageset']))
+                    self.notices.append(Notice.create(
+                        "%s: %s entries have been added or removed" % (
+                            self.queue,
+                            len(self.queue_state[self.queue] - new_list)),
+                        ['packageset'], "packageset", self.queue))
                 else:
                     # Print removed packages
                     for pkg in sorted(self.queue_state[self.queue] - new_list):
                         pkg_seriesurl, pkg_series, pkg_set, \
                             pkg_name = pkg.split(';')
 
-                        self.notices.append(("%s: Removed %s from %s in %s" % (
-                            self.queue, pkg_name, pkg_set, pkg_series),
-                            ['packageset']))
+                        self.notices.append(Notice.create(
+                            "%s: Removed %s from %s in %s" % (
+                                self.queue, pkg_name, pkg_set, pkg_series),
+                            ['packageset'], "packageset", self.queue,
+                            series=pkg_series, packageset=(pkg_set,),
+                            source=pkg_name))
 
                     # Print added packages
                     for pkg in sorted(new_list - self.queue_state[self.queue]):
                         pkg_seriesurl, pkg_series, pkg_set, \
                             pkg_name = pkg.split(';')
 
-                        self.notices.append(("%s: Added %s to %s in %s" % (
-                            self.queue, pkg_name, pkg_set, pkg_series),
-                            ['packageset']))
+                        self.notices.append(Notice.create(
+                            "%s: Added %s to %s in %s" % (
+                                self.queue, pkg_name, pkg_set, pkg_series),
+                            ['packageset'], "packageset", self.queue,
+                            series=pkg_series, packageset=(pkg_set,),
+                            source=pkg_name))
 
             self.queue_state[self.queue] = new_list
+            self.queue_index[self.queue] = build_index(new_list)
         except:
             # We don't want the bot to crash when LP fails
             traceback.print_exc()
@@ -81,14 +104,15 @@ class PackagesetScanner(threading.Thread):
 
 class Packageset():
     queue_state = dict()
+    queue_index = dict()
     scanner = PackagesetScanner()
     name = "packageset"
     queue = ""
+    generation = ""
 
     def __init__(self, queue, verbose=False):
         self.queue = queue
         self.verbose = verbose
-        self.spawn_scanner()
 
     def spawn_scanner(self):
         if self.scanner.is_alive():
@@ -96,18 +120,41 @@ class Packageset():
 
         self.scanner = PackagesetScanner()
         self.scanner.queue_state = self.queue_state
+        self.scanner.queue_index = self.queue_index
         self.scanner.verbose = self.verbose
         self.scanner.queue = self.queue
         self.scanner.start()
 
+    def start(self):
+        # Without coordination scan right away. Otherwise the first
+        # update() on the leader spawns it, so a node standing by for
+        # another instance never talks to the remote service
+        if self.scanner.ident is None:
+            self.spawn_scanner()
+
     def update(self):
         if self.scanner.is_alive():
             return False
 
         # Get the result from the thread
         notices = list(self.scanner.notices)
+        self.generation = self.scanner.generation
 
         # Spawn a new insance of the monitoring thread
         self.spawn_scanner()
 
         return notices
+
+    def index(self):
+        # Index over the last completed scan, None until the first one
+        return self.queue_index.get(self.queue)
+
+    def get_state(self):
+        return self.queue_state.get(self.queue)
+
+    def load_state(self, entries):
+        # Replace the baseline with a snapshot taken by another instance
+        self.queue_state[self.queue] = entries
+        self.queue_index[self.queue] = build_index(entries)
+        if not self.scanner.is_alive():
+            self.scanner.notices = list()
@@ -3,17 +3,36 @@ from __future__ import print_function
 
 import traceback
 import threading
-from launchpadlib.launchpad import Launchpad
+from . import lpcache
+from .index import StateIndex
+from .notice import Notice, state_digest
+
+
+def build_index(state):
+    """Index queue entries by series, pocket, source name and arch."""
+    entries = list()
+    for pkg in state:
+        pkg_seriesurl, pkg_pocket, pkg_name, pkg_version, \
+            pkg_arch, pkg_archive, pkg_self = pkg.split(';')
+        entries.append({
+            "series": pkg_pocket.split('-')[0],
+            "pocket": pkg_pocket,
+            "source": pkg_name,
+            "arch": pkg_arch,
+            "version": pkg_version,
+            "archive": pkg_archive,
+        })
+    return StateIndex(("series", "pocket", "source", "arch"), entries)
+
 
 class QueueScanner(threading.Thread):
     notices = list()
+    generation = ""
 
     def run(self):
         try:
             # Authenticated login to Launchpad
-            self.lp = Launchpad.login_anonymously(
-                'maubot-queuebot', 'production',
-                launchpadlib_dir="/tmp/queuebot-%s/" % self.queue)
+            self.lp = lpcache.login()
 
             self.notices = list()
 
@@ -60,6 +79,10 @@ class QueueScanner(threading.Thread):
                             pkg.self_link,
                         ]))
 
+            # The notices below are a diff against this baseline
+            self.generation = state_digest(
+                self.queue_state.get(self.queue, ()))
+
             if self.queue in self.queue_state:
                 # Print removed packages
                 for pkg in sorted(self.queue_state[self.queue] - new_list):
@@ -83,9 +106,13 @@ class QueueScanner(threading.Thread):
                         "queue;%s;%s" % (pkg_pocket, self.queue.lower()),
                         "queue;%s;%s" % (self.queue.lower(), pkg_pocket)
                         )
-                    self.notices.append(("%s: %s %s [%s] (%s) [%s]" % (
-                        self.queue, status, pkg_name, pkg_arch,
-                        pkg_pocket, pkg_version), mute))
+                    self.notices.append(Notice.create(
+                        "%s: %s %s [%s] (%s) [%s]" % (
+                            self.queue, status, pkg_name, pkg_arch,
+                            pkg_pocket, pkg_version), mute,
+                        "queue", self.queue,
+                        series=pkg_pocket.split('-')[0], pocket=pkg_pocket,
+                        arch=pkg_arch, source=pkg_name))
 
                 # Print added packages
                 for pkg in sorted(new_list - self.queue_state[self.queue]):
@@ -150,8 +177,13 @@ class QueueScanner(threading.Thread):
                         "queue;%s;%s" % (pkg_pocket, self.queue.lower()),
                         "queue;%s;%s" % (self.queue.lower(), pkg_pocket)
                         )
-                    self.notices.append((message, mute))
+                    self.notices.append(Notice.create(
+                        message, mute, "queue", self.queue,
+                        series=pkg_pocket.split('-')[0], pocket=pkg_pocket,
+                        arch=pkg_arch, packageset=sorted(current_pkgsets),
+                        source=pkg_name))
             self.queue_state[self.queue] = new_list
+            self.queue_index[self.queue] = build_index(new_list)
         except:
             # We don't want the bot to crash when LP fails
             traceback.print_exc()
@@ -159,14 +191,15 @@ class QueueScanner(threading.Thread):
 
 class Queue():
     queue_state = dict()
+    queue_index = dict()
     scanner = QueueScanner()
     name = "queue"
     queue = ""
+    generation = ""
 
     def __init__(self, queue, verbose=False):
         self.queue = queue
         self.verbose = verbose
-        self.spawn_scanner()
 
     def spawn_scanner(self):
         if self.scanner.is_alive():
@@ -174,18 +207,41 @@ class Queue():
 
         self.scanner = QueueScanner()
         self.scanner.queue_state = self.queue_state
+        self.scanner.queue_index = self.queue_index
         self.scanner.verbose = self.verbose
         self.scanner.queue = self.queue
         self.scanner.start()
 
+    def start(self):
+        # Without coordination scan right away. Otherwise the first
+        # update() on the leader spawns it, so a node standing by for
+        # another instance never talks to the remote service
+        if self.scanner.ident is None:
+            self.spawn_scanner()
+
     def update(self):
         if self.scanner.is_alive():
             return False
 
         # Get the result from the thread
         notices = list(self.scanner.notices)
+        self.generation = self.scanner.generation
 
         # Spawn a new insance of the monitoring thread
         self.spawn_scanner()
 
         return notices
+
+    def index(self):
+        # Index over the last completed scan, None until the first one
+        return self.queue_index.get(self.queue)
+
+    def get_state(self):
+        return self.queue_state.get(self.queue)
+
+    def load_state(self, entries):
+        # Replace the baseline with a snapshot taken by another instance
+        self.queue_state[self.queue] = entries
+        self.queue_index[self.queue] = build_index(entries)
+        if not self.scanner.is_alive():
+            self.scanner.notices = list()
@@ -3,10 +3,16 @@ from __future__ import print_function
 import threading
 import traceback
 import xmlrpc.client as xmlrpclib
+from .notice import Notice, state_digest
 
 
 class TrackerScanner(threading.Thread):
     notices = list()
+    generation = ""
+
+    def notice(self, message, build_milestone="", build_product=""):
+        return Notice.create(message, ("tracker",), "tracker", self.queue,
+                             milestone=build_milestone, product=build_product)
 
     def run(self):
         try:
@@ -38,6 +44,10 @@ class TrackerScanner(threading.Thread):
                                                   build_version,
                                                   build_status))
 
+            # The notices below are a diff against this baseline
+            self.generation = state_digest(
+                self.tracker_state.get(self.queue, ()))
+
             if self.queue in self.tracker_state:
                 build_products = [";".join(build.split(';')[0:2])
                                   for build in self.tracker_state[self.queue]]
@@ -64,26 +74,25 @@ class TrackerScanner(threading.Thread):
                         skip = True
 
                     if not skip:
-                        self.notices.append(("%s: %s [%s] has been removed" % (
-                            self.queue, build_product, build_milestone),
-                            ("tracker",)))
+                        self.notices.append(self.notice(
+                            "%s: %s [%s] has been removed" % (
+                                self.queue, build_product, build_milestone),
+                            build_milestone, build_product))
 
                 # Print other changes and deal with cases where a released
                 # milestone is moved back to testing
                 if len(new_list - self.tracker_state[self.queue]) > 25:
-                    self.notices.append((
+                    self.notices.append(self.notice(
                         "%s: %s entries have been "
                         "added, updated or disabled" % (
                             self.queue, len(new_list -
-                                            self.tracker_state[self.queue])),
-                        ("tracker",)))
+                                            self.tracker_state[self.queue]))))
                 elif len(self.tracker_state[self.queue] - new_list) > 25:
-                    self.notices.append((
+                    self.notices.append(self.notice(
                         "%s: %s entries have been "
                         "added, updated or disabled" % (
                             self.queue,
-                            len(self.tracker_state[self.queue] - new_list)),
-                        ("tracker",)))
+                            len(self.tracker_state[self.queue] - new_list))))
                 else:
                     for build in sorted(
                             new_list - self.tracker_state[self.queue]):
@@ -94,26 +103,29 @@ class TrackerScanner(threading.Thread):
                         if "%s;%s" % (build_milestone, build_product) \
                                 in build_products:
                             if build_status == "Re-building":
-                                self.notices.append((
+                                self.notices.append(self.notice(
                                     "%s: %s [%s] has been disabled" % (
                                         self.queue, build_product,
-                                        build_milestone), ("tracker",)))
+                                        build_milestone),
+                                    build_milestone, build_product))
                             elif build_status == "Ready":
-                                self.notices.append((
+                                self.notices.append(self.notice(
                                     "%s: %s [%s] has been marked as ready" % (
                                         self.queue, build_product,
-                                        build_milestone), ("tracker",)))
+                                        build_milestone),
+                                    build_milestone, build_product))
                             else:
-                                self.notices.append((
+                                self.notices.append(self.notice(
                                     "%s: %s [%s] has been updated (%s)" % (
                                         self.queue, build_product,
                                         build_milestone, build_version),
-                                    ("tracker",)))
+                                    build_milestone, build_product))
                         else:
-                            self.notices.append((
+                            self.notices.append(self.notice(
                                 "%s: %s [%s] (%s) has been added" % (
                                     self.queue, build_product, build_milestone,
-                                    build_version), ("tracker",)))
+                                    build_version),
+                                build_milestone, build_product))
 
             self.tracker_state[self.queue] = new_list
         except:
@@ -126,6 +138,7 @@ class Tracker():
     scanner = TrackerScanner()
     name = "tracker"
     queue = ""
+    generation = ""
 
     def __init__(self, queue, verbose=False):
         self.queue = queue
@@ -135,8 +148,6 @@ class Tracker():
         self.drupal = xmlrpclib.ServerProxy(
             "https://iso.qa.ubuntu.com/xmlrpc.php")
 
-        self.spawn_scanner()
-
     def spawn_scanner(self):
         if self.scanner.is_alive():
             raise Exception("Scanner is already running")
@@ -148,14 +159,31 @@ class Tracker():
         self.scanner.queue = self.queue
         self.scanner.start()
 
+    def start(self):
+        # Without coordination scan right away. Otherwise the first
+        # update() on the leader spawns it, so a node standing by for
+        # another instance never talks to the remote service
+        if self.scanner.ident is None:
+            self.spawn_scanner()
+
     def update(self):
         if self.scanner.is_alive():
             return False
 
         # Get the result from the thread
         notices = list(self.scanner.notices)
+        self.generation = self.scanner.generation
 
         # Spawn a new insance of the monitoring thread
         self.spawn_scanner()
 
         return notices
+
+    def get_state(self):
+        return self.tracker_state.get(self.queue)
+
+    def load_state(self, entries):
+        # Replace the baseline with a snapshot taken by another instance
+        self.tracker_state[self.queue] = entries
+        if not self.scanner.is_alive():
+            self.scanner.notices = list()
@@ -0,0 +1,45 @@
+from __future__ import annotations
+from .plugs.notice import Notice
+
+PLUGINS = ["queue", "tracker", "packageset"]
+
+class RoomRules:
+    """Queues, mutes and filters of a room, precomputed from its config.
+
+    Mutes are a set matched against Notice.keys, so muting e.g.
+    ``queue;noble-proposed`` costs one set intersection per notice.
+    Filters stay substring matches on the notice text, as they always
+    were, so existing room configs keep working; they are not indexed.
+    """
+
+    def __init__(self, room: dict, mutes: list | None = None):
+        self.queues = {}
+        for plugin in PLUGINS:
+            queues = room.get(plugin)
+            if isinstance(queues, str):
+                queues = [queues]
+            if isinstance(queues, list):
+                self.queues[plugin] = frozenset(queues)
+
+        if mutes is None:
+            mutes = room.get("mute")
+        if isinstance(mutes, list):
+            self.mutes = frozenset(str(mute).lower() for mute in mutes)
+        else:
+            self.mutes = frozenset()
+
+        self.filters = {}
+        for plugin in self.queues:
+            if room.get(plugin + "_filter") is not None:
+                self.filters[plugin] = str(room[plugin + "_filter"]).lower()
+
+    def enabled(self, notice: Notice) -> bool:
+        return notice.queue in self.queues.get(notice.plugin, ())
+
+    def muted(self, notice: Notice) -> bool:
+        return not self.mutes.isdisjoint(notice.keys)
+
+    def filtered(self, notice: Notice) -> bool:
+        """Whether the room's filter for the plugin drops the notice."""
+        wanted = self.filters.get(notice.plugin)
+        return wanted is not None and wanted not in notice.text.lower()
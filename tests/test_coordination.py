@@ -0,0 +1,178 @@
+import asyncio
+import logging
+
+import pytest
+
+from queuebot import coordination
+from queuebot.bot import Queuebot
+from queuebot.coordination import Coordinator
+from queuebot.plugs.notice import Notice, state_digest
+from queuebot.rules import RoomRules
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000000]
+    monkeypatch.setattr(coordination, "time", lambda: now[0])
+    return now
+
+
+def run_nodes(tmp_path, test, lease=60):
+    """Run test(a, b) with two nodes sharing one sqlite database."""
+    async def main():
+        url = f"sqlite:///{tmp_path / 'queuebot.db'}"
+        a = Coordinator(url, "node-a", lease=lease)
+        await a.start()
+        b = Coordinator(url, "node-b", lease=lease)
+        await b.start()
+        try:
+            await test(a, b)
+        finally:
+            await a.db.stop()
+            await b.db.stop()
+    asyncio.run(main())
+
+
+def test_lease_handover_on_expiry(tmp_path, clock):
+    async def test(a, b):
+        assert await a.acquire()
+        assert not await b.acquire()
+        clock[0] += 30
+        assert await a.acquire()
+        assert not await b.acquire()
+        # a stops renewing, b takes over within one lease period
+        clock[0] += 61
+        assert await b.acquire()
+        assert not await a.acquire()
+    run_nodes(tmp_path, test)
+
+
+def test_lease_handover_on_release(tmp_path, clock):
+    async def test(a, b):
+        assert await a.acquire()
+        await a.release()
+        assert not a.is_leader
+        assert await b.acquire()
+    run_nodes(tmp_path, test)
+
+
+def test_enqueue_dedups_replayed_diff_only(tmp_path, clock):
+    async def test(a, b):
+        assert await a.enqueue("tracker.Builds", "gen-1", "ready", ["!room"])
+        # The new leader replays the same diff against the same baseline
+        assert not await b.enqueue("tracker.Builds", "gen-1", "ready", ["!room"])
+        # The same text again later is a new event
+        assert await b.enqueue("tracker.Builds", "gen-2", "ready", ["!room"])
+        assert len(await a.pending()) == 2
+    run_nodes(tmp_path, test)
+
+
+def test_claim_race_has_one_winner(tmp_path, clock):
+    async def test(a, b):
+        await a.enqueue("queue.New", "gen-1", "notice", ["!one", "!two"])
+        (notice_hash, room_id, body), _ = await b.pending()
+        claims = await asyncio.gather(a.claim(notice_hash, room_id),
+                                      b.claim(notice_hash, room_id))
+        assert sorted(claims, key=lambda claim: claim is None) == [1, None]
+        assert [room for _, room, _ in await a.pending()] == ["!two"]
+    run_nodes(tmp_path, test)
+
+
+def test_unmarked_delivery_goes_to_new_leader(tmp_path, clock):
+    async def test(a, b):
+        await a.enqueue("queue.New", "gen-1", "notice", ["!room"])
+        notice_hash, room_id, body = (await a.pending())[0]
+        assert await a.claim(notice_hash, room_id) == 1
+        # a dies before marking the notice as sent
+        clock[0] += 61
+        assert await b.pending() == [(notice_hash, room_id, body)]
+        assert await b.claim(notice_hash, room_id) == 2
+        await b.mark_sent(notice_hash, room_id)
+        clock[0] += 61
+        assert await a.pending() == []
+    run_nodes(tmp_path, test)
+
+
+def test_failing_delivery_is_given_up_and_pruned(tmp_path, clock):
+    async def test(a, b):
+        a.retention = 0
+        await a.enqueue("queue.New", "gen-1", "notice", ["!gone"])
+        notice_hash, room_id, body = (await a.pending())[0]
+        for attempt in range(1, Coordinator.max_attempts + 1):
+            assert await a.claim(notice_hash, room_id) == attempt
+            clock[0] += 61
+        assert await a.claim(notice_hash, room_id) is None
+        assert await a.pending() == []
+        await a.prune()
+        assert await a.db.fetchval("SELECT COUNT(*) FROM notice_outbox") == 0
+    run_nodes(tmp_path, test)
+
+
+def test_state_and_mutes_are_shared(tmp_path, clock):
+    async def test(a, b):
+        await a.save_state("queue.New", {"x;y", "z"})
+        assert await b.load_state("queue.New") == {"x;y", "z"}
+        assert await b.load_state("queue.Unapproved") is None
+        await a.save_mutes("#room", ["queue;noble-proposed"])
+        assert await b.load_mutes() == {"#room": ["queue;noble-proposed"]}
+    run_nodes(tmp_path, test)
+
+
+class FakePlugin:
+    name = "queue"
+    queue = "New"
+
+    def __init__(self):
+        self.state = {"a"}
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+        self.generation = state_digest(self.state)
+        self.state = self.state | {"b"}
+        return [Notice.create("b accepted", (), "queue", "New")]
+
+    def get_state(self):
+        return self.state
+
+
+class FlakyCoordinator(Coordinator):
+    failures = 1
+
+    async def publish(self, *args):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database went away")
+        return await super().publish(*args)
+
+
+def test_failed_publish_is_retried_before_next_scan(tmp_path, clock):
+    async def main():
+        coordinator = FlakyCoordinator(f"sqlite:///{tmp_path / 'queuebot.db'}", "node-a")
+        await coordinator.start()
+        bot = Queuebot.__new__(Queuebot)
+        bot.log = logging.getLogger("test")
+        bot.coordinator = coordinator
+        bot.unpublished = {}
+        bot.room_ids = ["!room"]
+        bot.room_mapping = {"!room": "#room"}
+        bot.room_rules = {"#room": RoomRules({"queue": ["New"]})}
+
+        async def resolve_room_aliases():
+            return True
+        bot.resolve_room_aliases = resolve_room_aliases
+        plugin = FakePlugin()
+        try:
+            await bot.publish(plugin)
+            assert "queue.New" in bot.unpublished
+            assert await coordinator.pending() == []
+            assert await coordinator.load_state("queue.New") is None
+            # The next poll publishes the kept batch instead of scanning
+            await bot.publish(plugin)
+            assert plugin.updates == 1
+            assert bot.unpublished == {}
+            assert [body for _, _, body in await coordinator.pending()] == ["b accepted"]
+            assert await coordinator.load_state("queue.New") == {"a", "b"}
+        finally:
+            await coordinator.db.stop()
+    asyncio.run(main())
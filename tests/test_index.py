@@ -0,0 +1,82 @@
+from queuebot.plugs import packageset, queue
+from queuebot.plugs.index import (StateIndex, packageset_sources, paginate,
+                                  parse_query)
+
+
+def queue_index():
+    return queue.build_index({
+        "s;noble-proposed;kdelibs;2;source;primary;x",
+        "s;noble-proposed;foo;1;amd64;primary;x",
+        "s;noble-release;foo;1;source;primary;x",
+        "s;jammy-proposed;foo;0;source;primary;x",
+        "s;jammy-proposed;bar;3;source;primary;x",
+    })
+
+
+def packageset_index():
+    return packageset.build_index({
+        "s;noble;xorg;xorg-server",
+        "s;noble;desktop;xorg",
+        "s;jammy;desktop;xorg",
+        "s;noble;kubuntu;kdelibs",
+        "s;jammy;kubuntu;bar",
+    })
+
+
+def test_lookup_intersects_criteria():
+    index = queue_index()
+    assert [(entry["pocket"], entry["arch"]) for entry in
+            index.lookup(source="foo", series="noble")] == [
+        ("noble-proposed", "amd64"), ("noble-release", "source")]
+    assert index.lookup(source="foo", pocket={"jammy-proposed"}) == [
+        {"series": "jammy", "pocket": "jammy-proposed", "source": "foo",
+         "arch": "source", "version": "0", "archive": "primary"}]
+    assert index.lookup(source="bar", series="noble") == []
+    assert index.lookup(source="missing") == []
+
+
+def test_lookup_returns_entries_in_field_order():
+    index = StateIndex(("series", "source"), [
+        {"series": "noble", "source": "b"},
+        {"series": "jammy", "source": "c"},
+        {"series": "noble", "source": "a"},
+    ])
+    assert [entry["source"] for entry in index.lookup()] == ["c", "a", "b"]
+    assert [entry["source"] for entry in index.lookup(
+        source={"b", "a"})] == ["a", "b"]
+
+
+def test_paginate_clamps_page():
+    items = list(range(25))
+    assert paginate(items, 1) == (list(range(10)), 1, 3)
+    assert paginate(items, 3) == ([20, 21, 22, 23, 24], 3, 3)
+    assert paginate(items, 9) == ([20, 21, 22, 23, 24], 3, 3)
+    assert paginate(items, 0) == (list(range(10)), 1, 3)
+    assert paginate([], 2) == ([], 1, 1)
+
+
+def test_parse_query_sorts_terms_into_fields():
+    criteria, page, unknown = parse_query(
+        queue_index(), ["noble-proposed", "amd64", "2", "nope"])
+    assert criteria == {"pocket": {"noble-proposed"}, "arch": {"amd64"}}
+    assert page == 2
+    assert unknown == ["nope"]
+
+
+def test_packageset_query_prefers_sources():
+    index = packageset_index()
+    # xorg is both a source and a packageset, people ask about the source
+    criteria, page, unknown = parse_query(
+        index, ["xorg", "noble"], ("series", "source", "packageset"))
+    assert criteria == {"source": {"xorg"}, "series": {"noble"}}
+    assert index.lookup(**criteria) == [
+        {"series": "noble", "packageset": "desktop", "source": "xorg"}]
+
+
+def test_packageset_sources_follow_query_series():
+    index = packageset_index()
+    assert packageset_sources(index, ["kubuntu"], {}) == {"kdelibs", "bar"}
+    assert packageset_sources(
+        index, ["kubuntu"], {"series": {"noble"}}) == {"kdelibs"}
+    assert packageset_sources(
+        index, ["kubuntu"], {"pocket": {"jammy-proposed"}}) == {"bar"}
@@ -0,0 +1,76 @@
+import os
+from types import SimpleNamespace
+
+from queuebot.plugs.lpcache import SharedCache
+
+
+def response(status=200, fromcache=False):
+    return SimpleNamespace(status=status, fromcache=fromcache)
+
+
+def test_set_and_delete_track_size(tmp_path):
+    cache = SharedCache(str(tmp_path))
+    cache.set("a", b"12345")
+    cache.set("b", b"123")
+    assert cache.size == 8
+    # Rewriting an entry only counts the difference
+    cache.set("a", b"12")
+    assert cache.size == 5
+    cache.delete("a")
+    assert cache.size == 3
+    cache.delete("missing")
+    assert cache.size == 3
+    assert SharedCache(str(tmp_path)).size == 3
+
+
+def test_evict_drops_least_recently_used(tmp_path):
+    cache = SharedCache(str(tmp_path), max_size=10)
+    cache.set("old", b"1234")
+    cache.set("new", b"1234")
+    os.utime(cache._get_key_path("old"), (1, 1))
+    cache.set("newest", b"1234")
+    assert not os.path.exists(cache._get_key_path("old"))
+    assert cache.size == 8
+    assert cache.stats()["evictions"] == 1
+
+
+def test_track_classifies_responses(tmp_path):
+    cache = SharedCache(str(tmp_path))
+    cache.set("entry", b"body")
+    path = cache._get_key_path("entry")
+    os.utime(path, (1, 1))
+
+    def downloaded(uri, method):
+        cache.set("entry", b"body")
+        return response(), b"body"
+
+    def not_modified(uri, method):
+        cache.get("entry")
+        # httplib2 stores the refreshed headers and serves the cached body
+        cache.set("entry", b"body")
+        return response(fromcache=True), b"body"
+
+    def fresh(uri, method):
+        cache.get("entry")
+        return response(fromcache=True), b"body"
+
+    def redirected(uri, method):
+        if uri == "/old":
+            return cache.track(redirected, "/new", method)
+        return response(), b"body"
+
+    def failed(uri, method):
+        return response(status=404), b""
+
+    cache.track(downloaded, "/entry")
+    cache.track(not_modified, "/entry")
+    os.utime(path, (1, 1))
+    cache.track(fresh, "/entry")
+    # Fresh hits are touched so they are not evicted first
+    assert os.stat(path).st_mtime > 1
+    cache.track(redirected, "/old")
+    cache.track(failed, "/entry")
+    cache.track(downloaded, "/entry", "POST")
+    stats = cache.stats()
+    assert (stats["downloaded"], stats["not_modified"], stats["fresh"]) == (
+        2, 1, 1)
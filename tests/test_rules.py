@@ -0,0 +1,67 @@
+from queuebot.plugs.notice import Notice, mute_key
+from queuebot.rules import RoomRules
+
+
+def queue_notice():
+    pocket = "noble-proposed"
+    mute = ("queue;%s" % pocket, "queue;new",
+            "queue;%s;new" % pocket, "queue;new;%s" % pocket)
+    return Notice.create(
+        "New: kdelibs (noble-proposed/main) [1 => 2] (kubuntu)", mute,
+        "queue", "New", series="noble", pocket=pocket, arch="source",
+        packageset=["kubuntu"], source="kdelibs")
+
+
+def test_mute_key_normalises_values():
+    assert mute_key("Noble Daily") == "noble-daily"
+    assert mute_key("  Ubuntu\tServer ") == "ubuntu-server"
+    assert mute_key("noble-proposed") == "noble-proposed"
+
+
+def test_notice_keys():
+    notice = queue_notice()
+    assert notice[:2] == (notice.text, notice.mute)
+    assert {"queue", "queue.new", "queue;new", "queue;noble-proposed",
+            "queue;noble-proposed;new", "queue;new;noble-proposed",
+            "queue;noble", "queue;kubuntu", "queue;kdelibs;new",
+            "queue;new;source"} <= notice.keys
+    assert "queue;jammy" not in notice.keys
+
+    notice = Notice.create("Build ready", ("tracker",), "tracker", "Builds",
+                           milestone="Noble Daily", product="Ubuntu Server")
+    assert {"tracker", "tracker.builds", "tracker;noble-daily",
+            "tracker;ubuntu-server;builds"} <= notice.keys
+
+
+def test_room_rules_enabled():
+    rules = RoomRules({"queue": ["New"], "tracker": "Builds"})
+    assert rules.enabled(queue_notice())
+    assert rules.enabled(Notice.create("x", (), "tracker", "Builds"))
+    assert not rules.enabled(Notice.create("x", (), "queue", "Unapproved"))
+    assert not rules.enabled(Notice.create("x", (), "packageset", "noble"))
+
+
+def test_room_rules_legacy_mutes():
+    notice = queue_notice()
+    assert not RoomRules({"queue": ["New"]}).muted(notice)
+    for mute in ("queue.new", "queue;noble-proposed", "Queue;New",
+                 "queue;new;noble-proposed", "queue"):
+        assert RoomRules({"queue": ["New"], "mute": [mute]}).muted(notice)
+    assert not RoomRules({"queue": ["New"],
+                          "mute": ["queue;jammy-proposed"]}).muted(notice)
+    # Mutes stored by !qbot mute win over the config ones
+    rules = RoomRules({"mute": ["queue.new"]}, ["tracker"])
+    assert not rules.muted(notice)
+
+
+def test_room_rules_filters_are_substrings():
+    notice = queue_notice()
+    assert not RoomRules({"queue": ["New"]}).filtered(notice)
+    for wanted in ("kdelibs", "KDE", "1 => 2", "proposed/main"):
+        assert not RoomRules({"queue": ["New"],
+                              "queue_filter": wanted}).filtered(notice)
+    assert RoomRules({"queue": ["New"],
+                      "queue_filter": "xorg"}).filtered(notice)
+    # Filters of other plugins don't apply
+    assert not RoomRules({"queue": ["New"], "tracker": ["Builds"],
+                          "tracker_filter": "xorg"}).filtered(notice)